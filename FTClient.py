@@ -1,5 +1,5 @@
 #! /usr/bin/env python3
-import socket, sys, re, os, uuid
+import socket, sys, os, uuid
 
 from archiver import Archiver
 
@@ -21,51 +21,47 @@ if usage or not fileListStr:
 
 fileList = fileListStr.split()
 
-# Archive the files
+# Size the archive up front; it is streamed straight to the server, never written to disk
 archiveName = f"archive_{uuid.uuid4().hex[:8]}.tar"
+archiver = Archiver()
 try:
-    print(f"Archiving files {fileList} into {archiveName}")
-    archiver = Archiver()
-    archiver.archive(archiveName, fileList)
+    fileSize, memberSizes = archiver.archive_size(fileList)
 except Exception as e:
     print("Archiving failed:", e)
     sys.exit(1)
 
 # Connect to server
 try:
-    serverHost, serverPort = re.split(":", server)
+    serverHost, serverPort = server.rsplit(":", 1)
     serverPort = int(serverPort)
-except:
+except ValueError:
     print("Invalid server format. Use host:port")
     sys.exit(1)
 
 s = socket.create_connection((serverHost, serverPort))
+s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # Don't let Nagle hold back small writes
 print(f"Connected to server at {serverHost}:{serverPort}")
 
-# Send metadata: archive name and size
-fileSize = os.path.getsize(archiveName)
-metadata = f"{archiveName}\n{fileSize}\n".encode()
-s.sendall(metadata)
-
-# Send archive content
-fd_in = os.open(archiveName, os.O_RDONLY)
-bytesSent = 0
-
 try:
-    while True:
-        chunk = os.read(fd_in, 4096)
-        if not chunk:
-            break
-        s.sendall(chunk)
-        bytesSent += len(chunk)
-        print(f"Sent {bytesSent}/{fileSize} bytes")
-except Exception as e:
+    # Cork the socket so the metadata and archive headers go out in full segments (Linux only)
+    cork = hasattr(socket, 'TCP_CORK')
+    if cork:
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+
+    # Send metadata: archive name and size
+    metadata = f"{archiveName}\n{fileSize}\n".encode()
+    s.sendall(metadata)
+
+    # Send archive content, archiving the files directly into the socket
+    print(f"Streaming files {fileList} as {archiveName}")
+    archiver.archive_to(s.fileno(), fileList, memberSizes)
+    if cork:
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0) # Uncork to flush the last partial segment
+except OSError as e:
     print("Failed to send file to server:", e)
     sys.exit(1)
-finally:
-    os.close(fd_in)
 
-print(f"\nSent archive '{archiveName}'")
+print(f"Sent archive '{archiveName}' ({fileSize} bytes)")
 s.shutdown(socket.SHUT_WR)
 
 response = s.recv(1024).decode()
@@ -2,18 +2,47 @@
 import socket
 import sys
 import os
-import select
+import selectors
+import fcntl
+import errno
+from collections import deque
 
 sys.path.append("../lib")
 from lib import params
 from archiver import Archiver
 
+CHUNK = 1 << 20 # Max bytes moved per I/O call
+SPLICE_UNSUPPORTED = (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP) # splice can't be used on these fds
+
+class BufferPool:
+    # Hands out fixed-size receive buffers and takes them back when a client closes,
+    # so buffers are reused across connections instead of reallocated each time
+    def __init__(self, slab=CHUNK, max_slabs=64):
+        self.slab = slab # Size of each buffer
+        self.max_slabs = max_slabs # Most idle buffers kept around; extras are left to be freed
+        self.free = deque() # Idle buffers ready for reuse
+
+    def acquire(self):
+        # Reuse an idle buffer if there is one, otherwise allocate a new one
+        if self.free:
+            return self.free.pop()
+        return bytearray(self.slab)
+
+    def release(self, buf):
+        # Return a buffer to the pool, dropping it if the pool is already full
+        if len(buf) == self.slab and len(self.free) < self.max_slabs:
+            self.free.append(buf)
+
+
 class FileServer:
     def __init__(self, port):
         self.listen_port = port
         self.server_socket = self.create_server_socket()
-        self.read_list = [self.server_socket] # List of sockets to monitor for incoming data
+        self.sel = selectors.DefaultSelector() # epoll on Linux: cost scales with ready sockets, not total
+        self.sel.register(self.server_socket, selectors.EVENT_READ, data='listen')
         self.clients = {} # Dictionary to track connected clients
+        self.pool = BufferPool(slab=CHUNK, max_slabs=64) # Shared receive buffers
+        self.pipe_r, self.pipe_w = self.create_splice_pipe() # Kernel-side staging for socket -> file copies
 
     def create_server_socket(self):
         # Initialize and bind the server socket
@@ -26,13 +55,32 @@ class FileServer:
         print(f"Server listening on 0.0.0.0:{self.listen_port}")
         return s
 
+    def create_splice_pipe(self):
+        # Pipe used to splice file data from sockets to disk without a userspace copy.
+        # Returns (None, None) where splice isn't available, so recv_into is used instead
+        if not hasattr(os, 'splice'):
+            return None, None
+        r, w = os.pipe()
+        try:
+            fcntl.fcntl(w, fcntl.F_SETPIPE_SZ, CHUNK) # Let each splice move up to CHUNK bytes
+        except (AttributeError, OSError):
+            pass # Default pipe size still works, just in smaller steps
+        return r, w
+
+    def disable_splice(self):
+        # Give up on splice for the rest of the run and use recv_into for everyone
+        os.close(self.pipe_r)
+        os.close(self.pipe_w)
+        self.pipe_r = self.pipe_w = None
+
     def accept_connection(self):
         # Accept a new client connection and configure it
         conn, addr = self.server_socket.accept()
         conn.setblocking(False)  # Set client socket to non-blocking mode
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # Send the reply without waiting on Nagle
         print(f"Connection from {addr}")
 
-        self.read_list.append(conn)
+        self.sel.register(conn, selectors.EVENT_READ, data='client')
         self.clients[conn] = {
             'state': 'header', # Waiting for header
             'buffer': b'', # Buffer for incoming data
@@ -41,83 +89,155 @@ class FileServer:
             'received': 0, # Number of bytes received so far
             'fd_out': None, # Output file descriptor
             'addr': addr, # Client address
+            'rxbuf': None, # Receive buffer borrowed from the pool while recv_into needs one
+            'rxmv': None, # View over rxbuf, so slices don't copy
         }
+        self.acquire_rxbuf(self.clients[conn])
+
+    def acquire_rxbuf(self, client):
+        # Borrow a receive buffer from the pool, reused for every recv until released
+        client['rxbuf'] = self.pool.acquire()
+        client['rxmv'] = memoryview(client['rxbuf'])
+
+    def release_rxbuf(self, client):
+        # Hand the client's receive buffer back to the pool, if it holds one
+        if client['rxbuf'] is not None:
+            client['rxmv'].release() # Drop the view before handing the buffer back
+            self.pool.release(client['rxbuf'])
+            client['rxbuf'] = client['rxmv'] = None
 
     def handle_client(self, sock):
         # process data for existing client
         client = self.clients[sock]
         try:
-            data = sock.recv(4096)
-            if not data:
-                raise ConnectionError("Disconnected") # Client has disconnected
+            if client['state'] == 'data' and self.pipe_w is not None and self.splice_data(sock, client):
+                return # File data went straight from the socket to disk
 
-            client['buffer'] += data  # Append data to client buffer
+            if client['rxbuf'] is None:
+                self.acquire_rxbuf(client) # Splice was given up on, so recv_into needs a buffer again
+            n = sock.recv_into(client['rxmv']) # Reuse the client's buffer, no allocation per recv
+            if not n:
+                raise ConnectionError("Disconnected") # Client has disconnected
+            data = client['rxmv'][:n]
 
             if client['state'] == 'header':
-                self.process_header(sock, client) # Parse header if in header state
+                client['buffer'] += data  # Header may arrive split across several recvs
+                data = self.process_header(sock, client) # Parse header, keep any file bytes after it
+                if client['state'] == 'data' and self.pipe_w is not None:
+                    self.release_rxbuf(client) # Splice takes over, so only the header needed the buffer
             if client['state'] == 'data':
-                self.process_data(sock, client) # Receive file data if in data state
+                self.process_data(sock, client, data) # Write file data straight out, no buffering
 
         except Exception as e:
             self.close_connection(sock, f"Error: {e}")
 
     def process_header(self, sock, client):
-        # Parse header containing filename and file size
-        parts = client['buffer'].split(b'\n', 2)
-        name, size, rest = parts
+        # Parse header containing filename and file size, returning the bytes that follow it
+        buf = client['buffer']
+        name_end = buf.find(b'\n')
+        size_end = buf.find(b'\n', name_end + 1) if name_end >= 0 else -1
+        if size_end < 0:
+            return b'' # Header not complete yet, wait for more data
 
-        client['archive_name'] = f"new_{name.decode().strip()}" # Prefix filename with 'new_'
-        client['file_size'] = int(size.decode().strip()) # Convert file size to int
-        client['buffer'] = rest # Remaining data after header
+        client['archive_name'] = f"new_{buf[:name_end].decode().strip()}" # Prefix filename with 'new_'
+        client['file_size'] = int(buf[name_end + 1:size_end]) # Convert file size to int (int() takes bytes and ignores whitespace)
+        client['buffer'] = b'' # Header consumed, buffer no longer needed
         client['state'] = 'data' # Move to data-receiving state
-        client['fd_out'] = open(client['archive_name'], 'wb') # Open file for writing
+        client['fd_out'] = os.open(client['archive_name'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644) # Raw fd, no Python-side buffering
+        return buf[size_end + 1:] # Remaining data after header
 
-    def process_data(self, sock, client):
+    def process_data(self, sock, client, data):
         # Write incoming file data to file
         remaining = client['file_size'] - client['received'] # Calculate remaining bytes
-        chunk = client['buffer'][:remaining] # Extract up to 'remaining' bytes
+        chunk = data[:remaining] # Up to 'remaining' bytes, without copying
 
-        if chunk:
-            client['fd_out'].write(chunk) # Write chunk to file
-            client['received'] += len(chunk) # Update received byte count
-            client['buffer'] = client['buffer'][len(chunk):] # Remove written bytes from buffer
+        while chunk:
+            written = os.write(client['fd_out'], chunk) # Write chunk to file
+            client['received'] += written # Update received byte count
+            chunk = chunk[written:] # Retry whatever a short write left behind
 
         if client['received'] >= client['file_size']:
-            # File transfer complete
-            client['fd_out'].close()
-            print(f"Archive '{client['archive_name']}' saved. Extracting...")
-            Archiver().extract(client['archive_name']) # Extract archive contents
-            print("Extraction complete.")
-            sock.sendall(f"Received and extracted {client['archive_name']}\n".encode())
-            self.close_connection(sock, "Transfer complete") # Close connection after processing
+            self.finish_transfer(sock, client)
+
+    def splice_data(self, sock, client):
+        # Move file data socket -> pipe -> file entirely inside the kernel.
+        # Returns False if splice can't be used, so the caller falls back to recv_into
+        remaining = client['file_size'] - client['received'] # Calculate remaining bytes
+        try:
+            n = os.splice(sock.fileno(), self.pipe_w, min(remaining, CHUNK),
+                          flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+        except BlockingIOError:
+            return True # Spurious wakeup, nothing to read yet
+        except OSError as e:
+            if e.errno not in SPLICE_UNSUPPORTED:
+                raise # A real socket error (e.g. reset), handled by closing this connection
+            self.disable_splice() # Nothing was moved, so recv_into can pick up from here
+            return False
+        if n == 0:
+            raise ConnectionError("Disconnected") # Client has disconnected
+
+        try:
+            while n:
+                moved = os.splice(self.pipe_r, client['fd_out'], n, flags=os.SPLICE_F_MOVE) # Drain pipe into file
+                client['received'] += moved # Update received byte count
+                n -= moved
+        except OSError as e:
+            if e.errno not in SPLICE_UNSUPPORTED:
+                # Bytes left in the pipe would leak into the next client's file, so start over with a fresh one
+                self.disable_splice()
+                self.pipe_r, self.pipe_w = self.create_splice_pipe()
+                raise
+            # The output file can't take spliced data: pull what's still in the pipe and stop splicing
+            try:
+                parts = []
+                while n:
+                    part = os.read(self.pipe_r, n)
+                    if not part:
+                        raise EOFError("Pipe drained early") # Can't happen while the pipe holds n bytes
+                    parts.append(part)
+                    n -= len(part)
+            finally:
+                self.disable_splice()
+            self.process_data(sock, client, b''.join(parts)) # Writes the bytes and finishes the transfer if done
+            return True
+
+        if client['received'] >= client['file_size']:
+            self.finish_transfer(sock, client)
+        return True
+
+    def finish_transfer(self, sock, client):
+        # File transfer complete
+        os.close(client['fd_out'])
+        client['fd_out'] = None # Already closed, so close_connection must not close it again
+        print(f"Archive '{client['archive_name']}' saved. Extracting...")
+        Archiver().extract(client['archive_name']) # Extract archive contents
+        print("Extraction complete.")
+        sock.sendall(f"Received and extracted {client['archive_name']}\n".encode())
+        self.close_connection(sock, "Transfer complete") # Close connection after processing
 
     def close_connection(self, sock, reason=""):
         # Clean up and close a client connection
         client = self.clients.get(sock)
         if client:
             try:
-                if client.get("fd_out"):
-                    client["fd_out"].close()  # Ensure file is closed
+                if client.get("fd_out") is not None:
+                    os.close(client["fd_out"])  # Ensure file is closed
             except Exception:
                 pass
+            self.release_rxbuf(client)
             print(f"Closing connection {client['addr']}. Reason: {reason}")
+        self.sel.unregister(sock)
         sock.close()
-        self.read_list.remove(sock)
         self.clients.pop(sock, None)
 
     def run(self):
         # Main server loop
         while True:
-            readable, _, exceptional = select.select(self.read_list, [], self.read_list)
-
-            for sock in readable:
-                if sock is self.server_socket:
+            for key, _ in self.sel.select():
+                if key.data == 'listen':
                     self.accept_connection()  # New incoming connection
                 else:
-                    self.handle_client(sock)  # Existing client sent data
-
-            for sock in exceptional:
-                self.close_connection(sock, "Exceptional condition")
+                    self.handle_client(key.fileobj)  # Existing client sent data
 
 
 def main():
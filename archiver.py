@@ -1,8 +1,54 @@
-import os, sys, re
+import os, sys, re, struct, errno
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK = 1 << 20 # Max bytes moved per I/O call
+PREFETCH = 4 # Files opened ahead of the one being written
+SMALL_FILE = 64 << 10 # Files up to this size are read whole by the prefetch workers
+SENDFILE_UNSUPPORTED = (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP) # sendfile can't be used on these fds
+
+# Archive format v2: MAGIC, then for each file a HEADER (file size, filename length)
+# followed by the filename and the file contents. v1 archives have no magic and store
+# both header fields as 8-digit zero-padded ASCII, which caps files at 99,999,999 bytes
+MAGIC = b'FTA2'
+HEADER = struct.Struct('<QQ') # Little-endian unsigned 64-bit: file size, filename length
+
+def write_all(fd, *parts):
+    # Write parts to fd back to back, in a single writev when the fd takes it all.
+    # Writes may be short (e.g. on a socket), so keep going until everything is out
+    views = deque(memoryview(p) for p in parts if len(p))
+    while views:
+        if hasattr(os, 'writev'):
+            n = os.writev(fd, views)
+        else:
+            n = os.write(fd, views[0])
+        while n:
+            if n >= len(views[0]):
+                n -= len(views.popleft())
+            else:
+                views[0] = views[0][n:]
+                n = 0
+
+def advise(fd, *advice):
+    # Hint the kernel how fd will be used, e.g. advise(fd, 'SEQUENTIAL').
+    # A no-op where posix_fadvise is missing
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    for a in advice:
+        try:
+            os.posix_fadvise(fd, 0, 0, getattr(os, f"POSIX_FADV_{a}"))
+        except OSError:
+            pass # Only a hint, e.g. not supported on pipes
 
 class Archiver:
     def __init__(self):
-        pass
+        self.copy_view = None # Reusable buffer for the read/write fallback, allocated on first use
+
+    def copy_buffer(self):
+        # memoryview over a CHUNK-sized bytearray, shared by every fallback copy
+        if self.copy_view is None:
+            self.copy_view = memoryview(bytearray(CHUNK))
+        return self.copy_view
 
     def archive(self, output_path, files):
 
@@ -12,111 +58,191 @@ class Archiver:
             os.write(2, f"Failed to open output file: {str(e)}\n".encode())
             sys.exit(1)
 
+        try:
+            self.archive_to(out_fd, files)
+        except OSError as e:
+            os.write(2, f"Failed to write archive: {str(e)}\n".encode())
+            os.close(out_fd)
+            sys.exit(1)
+        os.close(out_fd)
+
+    def archive_size(self, files):
+        # Returns (total, sizes): the bytes archive_to will write for files, so a receiver
+        # can be told up front, and each file's size, to pass on to archive_to
+        sizes = []
         for file in files:
             if not os.path.isfile(file):
-                os.write(2, f"File: {file}: does not exist!\n".encode())
-                os.close(out_fd)
-                sys.exit(1)
-
-            try:
-                fd = os.open(file, os.O_RDONLY)
-
-                # Get header info: file byte size, filename length, and filename
-                filename = os.path.basename(file).encode()
-                filename_len = len(filename)
-                filename_len = f"{filename_len:08d}".encode()
-                file_stat = os.fstat(fd)
-                filesize = file_stat.st_size
-                filesize = f"{filesize:08d}".encode()
-
-                # Write header to output file
-                os.write(out_fd, filesize)
-                os.write(out_fd, filename_len)
-                os.write(out_fd, filename)
-
-                # Write the file contents to output file
-                while True:
-                    chunk = os.read(fd, 4096)
-                    if not chunk:
-                        break
-                    os.write(out_fd, chunk)
-
-            except Exception as e:
-                os.write(2, f"Error archiving {file}: {str(e)}\n".encode())
-                os.close(out_fd)
-                sys.exit(1)
-            finally:
+                raise FileNotFoundError(f"File: {file}: does not exist!")
+            sizes.append(os.path.getsize(file))
+        headers = sum(HEADER.size + len(os.path.basename(file).encode()) for file in files)
+        return len(MAGIC) + headers + sum(sizes), sizes
+
+    def archive_to(self, out_fd, files, sizes=None):
+        # Write an archive of files to an already open fd, which may be a file or a socket.
+        # If sizes (from archive_size) is given, a file whose size has changed since is an
+        # error, so the output matches the total promised to the receiver.
+        # Worker threads open (and for small files, read) the next few files while the
+        # current one is written; output order still follows files
+        write_all(out_fd, MAGIC)
+        if sizes is None:
+            sizes = [None] * len(files)
+
+        with ThreadPoolExecutor(max_workers=PREFETCH) as pool:
+            pending = deque() # (file, future) pairs, in archive order
+            for file, expected in zip(files, sizes):
+                pending.append((file, pool.submit(self.open_member, file, expected)))
+                if len(pending) >= PREFETCH:
+                    self.write_member(out_fd, *pending.popleft())
+            while pending:
+                self.write_member(out_fd, *pending.popleft())
+
+    def open_member(self, file, expected=None):
+        # Runs in a worker thread. Returns (header, filesize, data, fd): small files come
+        # back fully read with fd None, larger ones as an open fd for the writer to stream
+        if not os.path.isfile(file):
+            raise FileNotFoundError(f"File: {file}: does not exist!")
+
+        fd = os.open(file, os.O_RDONLY)
+        try:
+            advise(fd, 'SEQUENTIAL', 'WILLNEED') # Read ahead aggressively
+
+            # Get header info: file byte size, filename length, and filename
+            filename = os.path.basename(file).encode()
+            file_stat = os.fstat(fd)
+            filesize = file_stat.st_size
+            if expected is not None and filesize != expected:
+                raise OSError(f"size changed from {expected} to {filesize} bytes since it was measured")
+
+            if filesize <= SMALL_FILE:
+                data = os.read(fd, filesize)
+                if len(data) < filesize:
+                    raise EOFError(f"file shrank to {len(data)} of {filesize} bytes while being read")
                 os.close(fd)
-
-    def extract(self, archive_path):
+                return HEADER.pack(filesize, len(filename)) + filename, filesize, data, None
+        except Exception:
+            os.close(fd)
+            raise
+        return HEADER.pack(filesize, len(filename)) + filename, filesize, None, fd
+
+    def write_member(self, out_fd, file, future):
+        # Write one prefetched file, header first, to out_fd. Problems with the input file
+        # are reported here; errors writing to out_fd are left to the caller
         try:
-            fd_in = os.open(archive_path, os.O_RDONLY)
-        except Exception as e:
-            os.write(2, f"Failed to open archive file: {str(e)}\n".encode())
-            sys.exit(1)
-        filesize = os.fstat(fd_in).st_size
-
-        iters = 0
-        # while True:
-        # Read file size
-        filesize_byte = os.read(fd_in, 8)
-        if not filesize_byte or len(filesize_byte) < 8:
-            if iters == 0:
-                print(f"Error reading header byte size: Got {filesize_byte}")
-                # os.write(2, f"Error reading header byte size: Got {filesize_byte}".encode())
-                # os.close(fd_in)
-                sys.exit(1)
-        iters += 1
-        filesize = int(filesize_byte.decode())
-
-
-        # Read filename length
-        filename_len_byte = os.read(fd_in, 8)
-        if not filename_len_byte or len(filename_len_byte) < 8:
-            print(f"Error reading header filename len: Got {filename_len_byte}")
-            # os.write(2, f"Error reading header filename length: Got {filename_len_byte}".encode())
-            # os.close(fd_in)
+            header, filesize, data, fd = future.result()
+        except FileNotFoundError as e:
+            os.write(2, f"{e}\n".encode())
             sys.exit(1)
-        filename_len = int(filename_len_byte.decode())
+        except Exception as e:
+            self.member_error(file, e)
 
-        # Read filename
-        filename_byte = os.read(fd_in, filename_len)
-        if not filename_byte or len(filename_byte) < 1:
-            os.write(2, f"Error reading header filename: Got {filename_byte}".encode())
-            os.close(fd_in)
-            sys.exit(1)
-        filename = filename_byte.decode()
-        filename = 'new_' + filename
+        if fd is None:
+            write_all(out_fd, header, data) # Header and contents in one syscall
+            return
 
         try:
-            # Open output file for writing
-            fd_out = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
-
-            # Write file contents
-            remaining = filesize
-            while remaining > 0:
-                chunk_size = min(remaining, 4096)
-                chunk = os.read(fd_in, chunk_size)
-                if not chunk:
-                    os.write(2, f"Error: Unexpected end of file while reading {filename}".encode())
-                    os.close(fd_out)
-                    os.close(fd_in)
-                    sys.exit(1)
-
-                os.write(fd_out, chunk)
-                remaining -= len(chunk)
+            write_all(out_fd, header)
 
-        except Exception as e:
-            os.write(2, f"Error creating file {filename}: {e}\n".encode())
-            if 'fd_out' in locals():
-                os.close(fd_out)
-            os.close(fd_in)
-            sys.exit(1)
+            # Write the file contents to output, letting the kernel do the copy
+            sent = 0
+            try:
+                while sent < filesize:
+                    n = os.sendfile(out_fd, fd, None, min(filesize - sent, CHUNK))
+                    if n == 0:
+                        break
+                    sent += n
+            except (OSError, AttributeError) as e:
+                if isinstance(e, OSError) and e.errno not in SENDFILE_UNSUPPORTED:
+                    raise # A real I/O error, not a missing sendfile
+                # No sendfile to this kind of fd here; copy whatever is left by hand
+                mv = self.copy_buffer()
+                while sent < filesize:
+                    try:
+                        n = os.readv(fd, [mv[:min(filesize - sent, CHUNK)]]) # Reads into the shared buffer, no new bytes object
+                    except OSError as e:
+                        self.member_error(file, e)
+                    if not n:
+                        break
+                    write_all(out_fd, mv[:n])
+                    sent += n
+
+            # The header promised filesize bytes; anything else would mis-frame the rest of the stream
+            if sent < filesize:
+                self.member_error(file, EOFError(f"file shrank to {sent} of {filesize} bytes while being archived"))
         finally:
-            if 'fd_out' in locals():
-                os.close(fd_out)
+            os.close(fd)
 
-        os.close(fd_in)
+    def member_error(self, file, e):
+        # Report a problem with an input file and give up on the archive
+        os.write(2, f"Error archiving {file}: {str(e)}\n".encode())
+        sys.exit(1)
+
+    def extract(self, archive_path):
+        # Raises OSError, ValueError or EOFError if the archive can't be read or is malformed,
+        # leaving it to the caller to decide whether that is fatal
+        fd_in = os.open(archive_path, os.O_RDONLY)
+        try:
+            advise(fd_in, 'SEQUENTIAL') # Archive is read front to back once
+
+            # v1 archives have no magic, so anything read here is the start of the first header
+            magic = os.read(fd_in, len(MAGIC))
+            v2 = magic == MAGIC
+            pending = b'' if v2 else magic
+
+            while True:
+                # Read file size and filename length (16 bytes in both formats)
+                header = pending + os.read(fd_in, HEADER.size - len(pending))
+                pending = b''
+                if not header:
+                    break # Clean end of archive
+                if len(header) < HEADER.size:
+                    raise EOFError(f"Error reading header: Got {header}")
+                if v2:
+                    filesize, filename_len = HEADER.unpack(header)
+                else:
+                    filesize = int(header[:8]) # int() parses ASCII bytes directly, no decode needed
+                    filename_len = int(header[8:])
+
+                # Read filename
+                filename_byte = os.read(fd_in, filename_len)
+                if not filename_byte or len(filename_byte) < filename_len:
+                    raise EOFError(f"Error reading header filename: Got {filename_byte}")
+                filename = filename_byte.decode()
+                filename = 'new_' + filename
+
+                fd_out = None
+                try:
+                    # Open output file for writing
+                    fd_out = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+                    # Write file contents, letting the kernel copy between the two files
+                    remaining = filesize
+                    try:
+                        while remaining > 0:
+                            n = os.sendfile(fd_out, fd_in, None, min(remaining, CHUNK))
+                            if n == 0:
+                                break
+                            remaining -= n
+                    except (OSError, AttributeError) as e:
+                        if isinstance(e, OSError) and e.errno not in SENDFILE_UNSUPPORTED:
+                            raise # A real I/O error, not a missing sendfile
+                        # No file-to-file sendfile here; copy whatever is left by hand
+                        mv = self.copy_buffer()
+                        while remaining > 0:
+                            n = os.readv(fd_in, [mv[:min(remaining, CHUNK)]]) # Reads into the shared buffer
+                            if not n:
+                                break
+                            write_all(fd_out, mv[:n])
+                            remaining -= n
+
+                    if remaining > 0:
+                        raise EOFError(f"Unexpected end of file while reading {filename}")
+                finally:
+                    if fd_out is not None:
+                        os.close(fd_out)
+
+            advise(fd_in, 'DONTNEED') # Done with the archive, free its page cache
+        finally:
+            os.close(fd_in)
 
 # Run script
 # if __name__ == '__main__':